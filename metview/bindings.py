@@ -17,9 +17,7 @@ import pkgutil
 import signal
 import tempfile
 
-import cffi
 import numpy as np
-from numpy.lib.arraysetops import _setxor1d_dispatcher, isin
 
 from metview.metviewpy.indexdb import FieldsetDb
 from metview.dataset import Dataset
@@ -43,7 +41,7 @@ LOG = logging.getLogger(__name__)
 
 
 def string_from_ffi(s):
-    return ffi.string(s).decode("utf-8")
+    return _ffi_string(s).decode("utf-8")
 
 
 # -----------------------------------------------------------------------------
@@ -69,13 +67,13 @@ class MetviewInvoker:
             return
 
         import atexit
-        import time
         import subprocess
+        import threading
 
         if self.debug:  # pragma: no cover
             print("MetviewInvoker: Invoking Metview")
         self.persistent_session = False
-        self.metview_replied = False
+        self.metview_replied = threading.Event()
         self.metview_startup_timeout = int(
             os.environ.get("METVIEW_PYTHON_START_TIMEOUT", "8")
         )  # seconds
@@ -113,14 +111,10 @@ class MetviewInvoker:
                 )
             raise exp
 
-        # wait for Metview to respond...
-        wait_start = time.time()
-        while not (self.metview_replied) and (
-            time.time() - wait_start < self.metview_startup_timeout
-        ):
-            time.sleep(0.001)
+        # wait for Metview to respond - the signal handler will wake us up
+        replied = self.metview_replied.wait(self.metview_startup_timeout)
 
-        if not (self.metview_replied):  # pragma: no cover
+        if not replied:  # pragma: no cover
             raise Exception(
                 'Command "metview" did not respond within '
                 + str(self.metview_startup_timeout)
@@ -145,7 +139,7 @@ class MetviewInvoker:
         if self.persistent_session:  # pragma: no cover
             return
 
-        if self.metview_replied:
+        if self.metview_replied.is_set():
             if self.debug:
                 print("MetviewInvoker: Closing Metview")
             metview_pid = self.info("EVENT_PID")
@@ -158,19 +152,31 @@ class MetviewInvoker:
     def signal_from_metview(self, *args):
         """Called when Metview sends a signal back to Python to say that it's started"""
         # print ('PYTHON: GOT SIGNAL BACK FROM METVIEW!')
-        self.metview_replied = True
+        self.metview_replied.set()
 
     def read_metview_settings(self, settings_file):
         """Parses the settings file generated by Metview and sets the corresponding env vars"""
-        import configparser
 
-        cf = configparser.ConfigParser()
-        cf.read(settings_file)
-        env_section = cf["Environment"]
+        # the file is a simple INI file with [Section] headers and key=value lines;
+        # keys are stored in uppercase, which is how they are looked up
+        sections = {}
+        section = None
+        with open(settings_file, "rt") as f:
+            for line in f:
+                line = line.strip()
+                if not line or line[0] in "#;":
+                    continue
+                if line.startswith("[") and line.endswith("]"):
+                    section = sections.setdefault(line[1:-1].strip(), {})
+                elif section is not None and "=" in line:
+                    key, value = line.split("=", 1)
+                    section[key.strip().upper()] = value.strip()
+
+        env_section = sections["Environment"]
         for envar in env_section:
-            # print('set ', envar.upper(), ' = ', env_section[envar])
-            os.environ[envar.upper()] = env_section[envar]
-        self.info_section = cf["Info"]
+            # print('set ', envar, ' = ', env_section[envar])
+            os.environ[envar] = env_section[envar]
+        self.info_section = sections["Info"]
 
     def info(self, key):
         """Returns a piece of Metview information that was not set as an env var"""
@@ -196,18 +202,27 @@ class MetviewInvoker:
 mi = MetviewInvoker()
 
 try:
-    ffi = cffi.FFI()
-    ffi.cdef(pkgutil.get_data("metview", "metview.h").decode("ascii"))
     mv_lib = mi.info("METVIEW_LIB")
     # is there a more general way to add to a path to a list of paths?
     os.environ["LD_LIBRARY_PATH"] = mv_lib + ":" + os.environ.get("LD_LIBRARY_PATH", "")
 
     try:
-        # Linux / Unix systems
-        lib = ffi.dlopen(os.path.join(mv_lib, "libMvMacro.so"))
-    except OSError:
-        # MacOS systems
-        lib = ffi.dlopen(os.path.join(mv_lib, "libMvMacro"))
+        # use the compiled bindings generated by builder.py if they are available -
+        # they do not need to parse metview.h on each import and call the C
+        # functions directly rather than through libffi
+        from metview._bindings import ffi, lib
+    except ImportError:
+        import cffi
+
+        ffi = cffi.FFI()
+        ffi.cdef(pkgutil.get_data("metview", "metview.h").decode("ascii"))
+
+        try:
+            # Linux / Unix systems
+            lib = ffi.dlopen(os.path.join(mv_lib, "libMvMacro.so"))
+        except OSError:
+            # MacOS systems
+            lib = ffi.dlopen(os.path.join(mv_lib, "libMvMacro"))
 
 except Exception as exp:  # pragma: no cover
     print(
@@ -228,6 +243,17 @@ mi.restore_signal_handlers()
 # fix for binder-hosted notebooks, where PWD and os.cwd() do not seem to be in sync
 os.putenv("PWD", os.getcwd())
 
+# the library functions used on every Metview call are looked up once here rather
+# than via an attribute lookup on lib each time
+_p_call_function = lib.p_call_function
+_p_result_as_value = lib.p_result_as_value
+_p_push_number = lib.p_push_number
+_p_push_string = lib.p_push_string
+_p_push_value = lib.p_push_value
+_p_push_nil = lib.p_push_nil
+_p_value_type = lib.p_value_type
+_ffi_string = ffi.string
+
 # -----------------------------------------------------------------------------
 #                        Classes to handle complex Macro types
 # -----------------------------------------------------------------------------
@@ -240,9 +266,9 @@ class Value:
 
     def push(self):
         if self.val_pointer is None:
-            lib.p_push_nil()
+            _p_push_nil()
         else:
-            lib.p_push_value(self.val_pointer)
+            _p_push_value(self.val_pointer)
 
     # if we steal a value pointer from a temporary Value object, we need to
     # ensure that the Metview Value is not destroyed when the temporary object
@@ -282,10 +308,14 @@ class Request(dict, Value):
     def __init__(self, req, myverb=None):
 
         if isinstance(req, Request):  # copy an existing Request
-            self.xx = _request(req.get_verb(), req)  # to avoid deletion of Macro object
+            verb = req.get_verb()
+            self.xx = _request(verb, req)  # to avoid deletion of Macro object
             self.val_pointer = self.xx.val_pointer
-            self.verb = req.get_verb()
-            self.update(req)  # copy into dict
+            self.verb = verb
+            # the Macro request is already a full copy and the source values are
+            # already in Metview style, so just copy the dict without going back
+            # through Metview for each parameter
+            dict.update(self, req)
             return
 
         if myverb:
@@ -311,14 +341,14 @@ class Request(dict, Value):
         return d
 
     # translate Python classes into Metview ones where needed - single parameter
-    def item_to_metview_style(self, key, value):
+    @staticmethod
+    def item_to_metview_style(key, value):
         modified = False
         delete_original_key = False
 
         # bool -> on/off
-        if isinstance(value, bool):
-            conversion_dict = {True: "on", False: "off"}
-            value = conversion_dict[value]
+        if type(value) is bool:
+            value = "on" if value else "off"
             modified = True
 
         # class_ -> class (because 'class' is a Python keyword and cannot be
@@ -349,8 +379,8 @@ class Request(dict, Value):
         if self.val_pointer:
             Value.push(self)
         else:
-            self.create_new(self.verb, self)
-            lib.p_push_request(r)
+            self.create_new(self.verb, dict(self))
+            Value.push(self)
 
     def update(self, items, sub=""):
         if sub:
@@ -376,7 +406,8 @@ class Request(dict, Value):
     def __setitem__(self, index, value):
         if (self.val_pointer) and (value is not None):
             new_key, new_val, _, _ = self.item_to_metview_style(index, value)
-            push_arg(new_key)
+            # parameter names are always strings, so push them directly
+            push_bytes(_encoded_key(new_key))
             push_arg(new_val)
             lib.p_set_subvalue_from_arg_stack(self.val_pointer)
             dict.__setitem__(self, new_key, new_val)
@@ -385,21 +416,41 @@ class Request(dict, Value):
 
 
 def push_bytes(b):
-    lib.p_push_string(b)
+    _p_push_string(b)
 
 
 def push_str(s):
     push_bytes(s.encode("utf-8"))
 
 
+# parameter names come from a small, fixed set, so we only encode each one once
+_KEY_CACHE = {}
+
+
+def _encoded_key(k):
+    b = _KEY_CACHE.get(k)
+    if b is None:
+        b = k.encode("utf-8")
+        _KEY_CACHE[k] = b
+    return b
+
+
 def push_list(lst):
     # ask Metview to create a new list, then add each element by
     # pusing it onto the stack and asking Metview to pop it off
     # and add it to the list
     mlist = lib.p_new_list(len(lst))
-    for i, val in enumerate(lst):
-        push_arg(val)
-        lib.p_add_value_from_pop_to_list(mlist, i)
+    add_to_list = lib.p_add_value_from_pop_to_list
+    if all(type(val) in (int, float) for val in lst):
+        # lists of plain numbers (e.g. levels) are common, so push them
+        # directly rather than going through push_arg() for each element
+        for i, val in enumerate(lst):
+            _p_push_number(float(val))
+            add_to_list(mlist, i)
+    else:
+        for i, val in enumerate(lst):
+            push_arg(val)
+            add_to_list(mlist, i)
     lib.p_push_list(mlist)
 
 
@@ -628,7 +679,7 @@ class ContainerValue(Value):
             elif isinstance(index, np.ndarray):  # can have an array as an index
                 return subset(self, index + self.macro_index_base)
             else:
-                c = int(count(self))
+                c = len(self)
                 if index < 0:  # negative index valid for range [-len..-1]
                     if index >= -c:
                         index = c + index
@@ -668,6 +719,7 @@ class Fieldset(FileBackedValueWithOperators, ContainerValue):
         self._db = None
         self._ds_param_info = None
         self._label = ""
+        self._count = None
 
         if (path is not None) and (fields is not None):
             raise ValueError("Fieldset cannot take both path and fields")
@@ -694,6 +746,13 @@ class Fieldset(FileBackedValueWithOperators, ContainerValue):
             lib.p_destroy_value(self.val_pointer)
         self.steal_val_pointer(temp)
         self._db = None
+        self._count = None
+
+    def __len__(self):
+        # the number of fields only changes via append(), so we cache it
+        if self._count is None:
+            self._count = ContainerValue.__len__(self)
+        return self._count
 
     def to_dataset(self, **kwarg):
         # soft dependency on cfgrib
@@ -991,13 +1050,13 @@ class ValuePusher:
         # note that Request must come before dict, because a Request inherits from dict;
         # this ordering requirement also means we should use list or tuple instead of a dict
         self.funcs = (
-            (float, lambda n: lib.p_push_number(n)),
-            ((int, np.number), lambda n: lib.p_push_number(float(n))),
+            (float, lambda n: _p_push_number(n)),
+            ((int, np.number), lambda n: _p_push_number(float(n))),
             (str, lambda n: push_str(n)),
             (Request, lambda n: n.push()),
             (dict, lambda n: Request(n).push()),
             ((list, tuple), lambda n: push_list(n)),
-            (type(None), lambda n: lib.p_push_nil()),
+            (type(None), lambda n: _p_push_nil()),
             (FileBackedValue, lambda n: n.push()),
             (np.datetime64, lambda n: push_date(n)),
             (datetime.datetime, lambda n: push_datetime(n)),
@@ -1008,15 +1067,25 @@ class ValuePusher:
             (Style, lambda n: push_style_object(n)),
             (Visdef, lambda n: push_style_object(n)),
         )
+        # the push function found for each concrete type, so that the list above
+        # only has to be searched the first time we see a given type
+        self.funcs_by_type = {}
 
     def push_value(self, val):
-        for typekey, typefunc in self.funcs:
-            if isinstance(val, typekey):
-                typefunc(val)
+        val_type = type(val)
+        typefunc = self.funcs_by_type.get(val_type)
+        if typefunc is None:
+            for typekey, func in self.funcs:
+                if issubclass(val_type, typekey):
+                    typefunc = func
+                    self.funcs_by_type[val_type] = typefunc
+                    break
+            else:
+                # if we haven't found one, then try the more complex types
+                try_to_push_complex_type(val)
                 return 1
 
-        # if we haven't returned yet, then try the more complex types
-        try_to_push_complex_type(val)
+        typefunc(val)
         return 1
 
 
@@ -1031,7 +1100,7 @@ def dict_to_pushed_args(d):
 
     # push each key and value onto the argument stack
     for k, v in d.items():
-        push_str(k)
+        push_bytes(_encoded_key(k))
         push_arg(v)
 
     return 2 * len(d)  # return the number of arguments generated
@@ -1045,18 +1114,12 @@ def dict_to_pushed_args(d):
 def list_from_metview(val):
 
     mlist = lib.p_value_as_list(val)
-    result = []
     n = lib.p_list_count(mlist)
-    all_vectors = True
-    for i in range(0, n):
-        mval = lib.p_list_element_as_value(mlist, i)
-        v = value_from_metview(mval)
-        if all_vectors and not isinstance(v, np.ndarray):
-            all_vectors = False
-        result.append(v)
+    list_element = lib.p_list_element_as_value
+    result = [value_from_metview(list_element(mlist, i)) for i in range(n)]
 
     # if this is a list of vectors, then create a 2-D numPy array
-    if all_vectors and n > 0:
+    if n > 0 and all(isinstance(v, np.ndarray) for v in result):
         result = np.stack(result, axis=0)
 
     # delete the Metview list - this will decrement the reference counts of its objects
@@ -1133,32 +1196,35 @@ class ValueReturner:
     """Class to handle return values from the Macro library"""
 
     def __init__(self):
-        self.funcs = {}
-        self.funcs[MvRetVal.tnumber.value] = lambda val: lib.p_value_as_number(val)
-        self.funcs[MvRetVal.tstring.value] = lambda val: string_from_metview(val)
-        self.funcs[MvRetVal.tgrib.value] = lambda val: Fieldset(val)
-        self.funcs[MvRetVal.trequest.value] = lambda val: Request(val)
-        self.funcs[MvRetVal.tbufr.value] = lambda val: Bufr(val)
-        self.funcs[MvRetVal.tgeopts.value] = lambda val: Geopoints(val)
-        self.funcs[MvRetVal.tlist.value] = lambda val: list_from_metview(val)
-        self.funcs[MvRetVal.tnetcdf.value] = lambda val: NetCDF(val)
-        self.funcs[MvRetVal.tnil.value] = lambda val: None
-        self.funcs[MvRetVal.terror.value] = lambda val: handle_error(val)
-        self.funcs[MvRetVal.tdate.value] = lambda val: datestring_from_metview(val)
-        self.funcs[MvRetVal.tvector.value] = lambda val: vector_from_metview(val)
-        self.funcs[MvRetVal.todb.value] = lambda val: Odb(val)
-        self.funcs[MvRetVal.ttable.value] = lambda val: Table(val)
-        self.funcs[MvRetVal.tgptset.value] = lambda val: GeopointSet(val)
-        self.funcs[MvRetVal.tfile.value] = lambda val: File(val)
+        funcs = {}
+        funcs[MvRetVal.tnumber.value] = lib.p_value_as_number
+        funcs[MvRetVal.tstring.value] = string_from_metview
+        funcs[MvRetVal.tgrib.value] = Fieldset
+        funcs[MvRetVal.trequest.value] = Request
+        funcs[MvRetVal.tbufr.value] = Bufr
+        funcs[MvRetVal.tgeopts.value] = Geopoints
+        funcs[MvRetVal.tlist.value] = list_from_metview
+        funcs[MvRetVal.tnetcdf.value] = NetCDF
+        funcs[MvRetVal.tnil.value] = lambda val: None
+        funcs[MvRetVal.terror.value] = handle_error
+        funcs[MvRetVal.tdate.value] = datestring_from_metview
+        funcs[MvRetVal.tvector.value] = vector_from_metview
+        funcs[MvRetVal.todb.value] = Odb
+        funcs[MvRetVal.ttable.value] = Table
+        funcs[MvRetVal.tgptset.value] = GeopointSet
+        funcs[MvRetVal.tfile.value] = File
+        # the return types are small consecutive integers, so we can index a
+        # tuple with them rather than look them up in the dict
+        self.funcs = tuple(funcs.get(i) for i in range(max(funcs) + 1))
 
     def translate_return_val(self, val):
-        rt = lib.p_value_type(val)
-        try:
-            return self.funcs[rt](val)
-        except Exception:
+        rt = _p_value_type(val)
+        func = self.funcs[rt] if 0 <= rt < len(self.funcs) else None
+        if func is None:
             raise Exception(
                 "value_from_metview got an unhandled return type: " + str(rt)
             )
+        return func(val)
 
 
 vr = ValueReturner()
@@ -1189,7 +1255,7 @@ def to_dataset(fs, *args, **kwargs):
 # -----------------------------------------------------------------------------
 
 
-def _call_function(mfname, *args, **kwargs):
+def _call_function(encoded_name, *args, **kwargs):
 
     nargs = 0
 
@@ -1197,22 +1263,29 @@ def _call_function(mfname, *args, **kwargs):
         actual_n_args = push_arg(n)
         nargs += actual_n_args
 
-    merged_dict = {}
-    merged_dict.update(kwargs)
-    if len(merged_dict) > 0:
-        dn = dict_to_pushed_args(Request(merged_dict))
+    if kwargs:
+        # only translate the keyword arguments if there is something to translate;
+        # we do not need to create a whole Request (and its Metview definition)
+        if "class_" in kwargs or any(type(v) is bool for v in kwargs.values()):
+            kwargs = dict(
+                Request.item_to_metview_style(k, v)[:2] for k, v in kwargs.items()
+            )
+        dn = dict_to_pushed_args(kwargs)
         nargs += dn
 
-    lib.p_call_function(mfname.encode("utf-8"), nargs)
+    _p_call_function(encoded_name, nargs)
 
 
 def make(mfname):
+    # encode the function name once here rather than on every call
+    encoded_name = mfname.encode("utf-8")
+
     def wrapped(*args, **kwargs):
-        err = _call_function(mfname, *args, **kwargs)
+        err = _call_function(encoded_name, *args, **kwargs)
         if err:
             pass  # throw Exception
 
-        val = lib.p_result_as_value()
+        val = _p_result_as_value()
         return value_from_metview(val)
 
     return wrapped
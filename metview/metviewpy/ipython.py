@@ -23,6 +23,11 @@ ipython_active = None
 def is_ipython_active():
     global ipython_active
     if ipython_active is None:
+        # if IPython has not been imported then we cannot be running in it, and
+        # we avoid the cost of importing it
+        if "IPython" not in sys.modules:
+            ipython_active = False
+            return ipython_active
         try:
             from IPython import get_ipython
 
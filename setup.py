@@ -14,7 +14,6 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-import io
 import os
 
 import setuptools
@@ -22,10 +21,8 @@ import setuptools
 
 def read(fname):
     file_path = os.path.join(os.path.dirname(__file__), fname)
-    file_handle = io.open(file_path, encoding="utf-8")
-    contents = file_handle.read()
-    file_handle.close()
-    return contents
+    with open(file_path, "rb") as file_handle:
+        return file_handle.read().decode("utf-8")
 
 
 version = None